@@ -0,0 +1,207 @@
+"""Per-folder activity: number of commits per day over the last days.
+"""
+import datetime
+import logging
+import posixpath
+import threading
+from array import array
+from collections import OrderedDict
+
+from config import ACTIVITY_DAYS, ACTIVITY_MAX_FOLDERS
+
+log = logging.getLogger(__name__)
+
+
+def today() -> int:
+    """Get the current UTC day as an ordinal.
+
+    Returns:
+        int: day ordinal
+    """
+    return datetime.datetime.now(datetime.timezone.utc).date().toordinal()
+
+
+class ActivityIndex:
+    """Daily commits counts by folder, updated with the commits fetched from GitHub.
+
+    Each folder has a fixed size ring buffer of counters (one per day), so the
+    cost of serving a time series or a ranking does not depend on the number
+    of commits. Only the `max_folders` most recently updated folders are kept.
+
+    Repositories names are case insensitive on GitHub, so they are lowercased:
+    a repository gets the same activity whatever the case of the URL used.
+    """
+
+    def __init__(
+        self, days: int = ACTIVITY_DAYS, max_folders: int = ACTIVITY_MAX_FOLDERS
+    ):
+        self.days = days
+        self.max_folders = max_folders
+        self.lock = threading.Lock()
+        # (repo, folder) -> array of counts, indexed by day % days, in update order
+        self._counts = OrderedDict()
+        self._last_day = {}  # (repo, folder) -> last day of the ring buffer
+        self._seen = {}  # (repo, folder) -> {commit sha: day}
+        self._children = {}  # (repo, folder) -> set of sub-folders with activity
+
+    def _advance(self, key: tuple, day: int):
+        """Move the ring buffer of a folder to `day`, resetting the outdated counters."""
+        counts = self._counts.get(key)
+        if counts is None:
+            self._counts[key] = array("I", [0] * self.days)
+            self._last_day[key] = day
+            self._seen[key] = {}
+            return
+        last_day = self._last_day[key]
+        if day <= last_day:
+            return
+        for d in range(last_day + 1, min(day, last_day + self.days) + 1):
+            counts[d % self.days] = 0
+        self._last_day[key] = day
+        self._seen[key] = {
+            sha: d for sha, d in self._seen[key].items() if day - d < self.days
+        }
+
+    def record(
+        self, repo: str, folder: str, commits: list, is_folder: bool = True
+    ) -> int:
+        """Count the commits of a folder, and of its parent folders.
+
+        Already counted commits (by sha) and commits older than the window
+        are ignored, so the same commits can be recorded several times.
+
+        Args:
+            repo (str): repository full name
+            folder (str): path of the folder the commits were fetched for
+            commits (list): list of commits, as returned by github_lib.get_commits
+            is_folder (bool, optional): False if the path is a file, or not known to be
+                a folder: it is then not listed as a sub-folder of its parent. Defaults to True.
+
+        Returns:
+            int: number of new commits
+        """
+        repo, folder = repo.lower(), folder.strip("/")
+        if not folder:
+            return 0
+        now = today()
+        recent_commits = []
+        for commit in commits:
+            date = commit.get("date")
+            if date.tzinfo:
+                date = date.astimezone(datetime.timezone.utc)
+            day = date.date().toordinal()
+            if 0 <= now - day < self.days:
+                recent_commits.append((str(commit.get("sha")), day))
+        if not recent_commits:
+            return 0
+        folders = []
+        while folder:
+            folders.append(folder)
+            folder = posixpath.dirname(folder)
+        new_commits = 0
+        with self.lock:
+            for path in folders:
+                key = (repo, path)
+                self._advance(key, now)
+                self._counts.move_to_end(key)
+                if is_folder or path != folders[0]:
+                    self._children.setdefault(
+                        (repo, posixpath.dirname(path)), set()
+                    ).add(path)
+                counts, seen = self._counts[key], self._seen[key]
+                for sha, day in recent_commits:
+                    if sha in seen:
+                        continue
+                    seen[sha] = day
+                    counts[day % self.days] += 1
+                    if path == folders[0]:
+                        new_commits += 1
+            while len(self._counts) > self.max_folders:
+                self._drop(next(iter(self._counts)))
+        if new_commits:
+            log.debug(f"{new_commits} new commits recorded for {repo}/{folders[0]}")
+        return new_commits
+
+    def _drop(self, key: tuple):
+        """Forget the activity of a folder."""
+        repo, folder = key
+        del self._counts[key]
+        del self._last_day[key]
+        del self._seen[key]
+        parent = (repo, posixpath.dirname(folder))
+        siblings = self._children.get(parent)
+        if siblings is not None:
+            siblings.discard(folder)
+            if not siblings:
+                del self._children[parent]
+
+    def series(self, repo: str, folder: str) -> list:
+        """Get the daily commits counts of a folder, from the oldest to the current day.
+
+        Args:
+            repo (str): repository full name
+            folder (str): folder path
+
+        Returns:
+            list: list of `days` counts
+        """
+        key = (repo.lower(), folder.strip("/"))
+        with self.lock:
+            if key not in self._counts:
+                return [0] * self.days
+            now = today()
+            self._advance(key, now)
+            counts = self._counts[key]
+            return [counts[d % self.days] for d in range(now - self.days + 1, now + 1)]
+
+    def folders(self, repo: str, folders: list) -> dict:
+        """Get the activity of several folders.
+
+        Args:
+            repo (str): repository full name
+            folders (list): list of folders paths
+
+        Returns:
+            dict: by folder path, the daily counts ("series") and the number of
+                commits over the last 7 days ("week")
+        """
+        activity = {}
+        for folder in folders:
+            series = self.series(repo, folder)
+            activity[folder] = {"series": series, "week": sum(series[-7:])}
+        return activity
+
+    def children(self, repo: str, folder: str = "") -> list:
+        """Get the sub-folders of a folder with recorded commits.
+
+        Args:
+            repo (str): repository full name
+            folder (str, optional): parent folder path. Defaults to "" (repository root).
+
+        Returns:
+            list: list of folders paths
+        """
+        with self.lock:
+            return sorted(self._children.get((repo.lower(), folder.strip("/")), ()))
+
+    def ranking(self, repo: str, folder: str = "", limit: int = 5) -> list:
+        """Get the sub-folders of a folder with the most commits over the last 7 days.
+
+        Args:
+            repo (str): repository full name
+            folder (str, optional): parent folder path. Defaults to "" (repository root).
+            limit (int, optional): max number of sub-folders, None for all. Defaults to 5.
+
+        Returns:
+            list: list of (folder path, number of commits) tuples
+        """
+        ranking = [
+            (path, stats["week"])
+            for path, stats in self.folders(repo, self.children(repo, folder)).items()
+            if stats["week"]
+        ]
+        ranking.sort(key=lambda item: (-item[1], item[0]))
+        return ranking[:limit]
+
+
+activity = ActivityIndex()
@@ -0,0 +1,117 @@
+"""Admission control to protect the shared GitHub token.
+"""
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import g
+from werkzeug.exceptions import ServiceUnavailable
+from cachetools import cached, TTLCache
+from github import Github
+
+from config import (
+    CACHE_SIZE,
+    CLIENT_RATE,
+    CLIENT_BURST,
+    MAX_UPSTREAM_FETCHES,
+    UPSTREAM_QUEUE_TIMEOUT,
+    SHARED_TOKEN_RESERVE,
+    RATE_LIMIT_CHECK_TTL,
+    GITHUB_ACCESS_TOKEN,
+)
+
+log = logging.getLogger(__name__)
+
+# Token buckets of the anonymous clients: (tokens, last update) by client.
+# An idle client gets a full bucket back, so its entry can expire.
+buckets = TTLCache(maxsize=CACHE_SIZE, ttl=CLIENT_BURST / CLIENT_RATE)
+buckets_lock = threading.Lock()
+
+# Slots for the GitHub API calls of this worker
+upstream_slots = threading.BoundedSemaphore(MAX_UPSTREAM_FETCHES)
+
+
+def admit_client(client: str) -> float:
+    """Take a token from the bucket of a client.
+
+    Args:
+        client (str): client identifier (IP address)
+
+    Returns:
+        float: 0 if the client is allowed to send the request, else the number of
+            seconds until the next token
+    """
+    now = time.monotonic()
+    with buckets_lock:
+        tokens, last = buckets.get(client, (CLIENT_BURST, now))
+        tokens = min(CLIENT_BURST, tokens + (now - last) * CLIENT_RATE)
+        retry_after = 0 if tokens >= 1 else (1 - tokens) / CLIENT_RATE
+        if not retry_after:
+            tokens -= 1
+        buckets[client] = (tokens, now)
+    if retry_after:
+        log.info(f"Request rate limit exceeded for client {client}")
+    return retry_after
+
+
+@cached(TTLCache(maxsize=1, ttl=RATE_LIMIT_CHECK_TTL), lock=threading.Lock())
+def get_shared_budget() -> int:
+    """Get the number of remaining requests of the shared GitHub token.
+
+    The rate limit endpoint does not count against the budget.
+
+    Returns:
+        int: remaining requests, -1 if unknown
+    """
+    try:
+        return Github(GITHUB_ACCESS_TOKEN).rate_limiting[0]
+    except Exception as e:
+        log.error(e, e.__traceback__)
+        return -1
+
+
+def shared_budget_low() -> bool:
+    """Check if the shared GitHub token is close to its rate limit.
+
+    Returns:
+        bool: True if less than SHARED_TOKEN_RESERVE requests remain
+    """
+    return 0 <= get_shared_budget() < SHARED_TOKEN_RESERVE
+
+
+def upstream_fetch(f):
+    """Decorator for the functions calling the GitHub API.
+
+    To be used below the cache decorator, so that it only applies on cache
+    misses: the number of concurrent calls is capped per worker (requests
+    wait for a free slot up to UPSTREAM_QUEUE_TIMEOUT), and requests
+    restricted to cached data (`g.cached_only`) are rejected.
+
+    Args:
+        f (_type_): function to decorate
+
+    Returns:
+        function: decorated function
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if g.get("cached_only"):
+            raise ServiceUnavailable(
+                "GitHub API budget is low: "
+                "this repository is only available from cache for now",
+                retry_after=RATE_LIMIT_CHECK_TTL,
+            )
+        if not upstream_slots.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT):
+            log.warning("No free slot to call the GitHub API")
+            raise ServiceUnavailable(
+                "Too many pending requests to GitHub, please retry later",
+                retry_after=UPSTREAM_QUEUE_TIMEOUT,
+            )
+        try:
+            return f(*args, **kwargs)
+        finally:
+            upstream_slots.release()
+
+    return decorated_function
@@ -22,8 +22,9 @@ import coloredlogs
 from config import *
 
 # Import local modules
-from utils import get_feed, cache, cache_home, get_repo_config
-from github_lib import get_repo_contents, get_repo, login_management, get_commits
+from utils import get_feed, cache, cache_home, get_repo_config, start_cache_snapshots
+from github_lib import get_folder_contents, get_repo, login_management, get_commits
+from activity import activity
 from flask_dance.contrib.github import github as gh_auth
 from base_routes import *
 
@@ -40,6 +41,9 @@ else:
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
     coloredlogs.install(level="INFO")
 
+# warm up the caches from the last snapshot before serving requests
+start_cache_snapshots()
+
 
 @app.route("/")
 @login_management
@@ -72,6 +76,9 @@ def home():
 def repo_home(repo_owner: str, repo_name: str):
     """List files and folders to get commits logs from.
 
+    The `folder` query parameter allows to browse the sub-folders of the
+    articles folder.
+
     Args:
         repo_owner (str): GitHub repo owner.
         repo_name (str): GitHub repo name.
@@ -79,21 +86,29 @@ def repo_home(repo_owner: str, repo_name: str):
     Returns:
         str: html page
     """
+    folder = request.args.get("folder", "").strip("/")
     config_repo = get_repo_config(repo_owner, repo_name)
     repo = get_repo(
         g,
         config_repo=config_repo,
         cache_key=f"{config_repo.get('name')}-{sha256(g.gh_token.encode()).hexdigest()}",
     )
-    contents = get_repo_contents(
+    _folder_path = os.path.join(config_repo.get("articles_folder").strip("/"), folder)
+    contents = get_folder_contents(
         repo,
-        path=config_repo.get("articles_folder").lstrip("/").rstrip("/"),
+        root=config_repo.get("articles_folder"),
+        path=folder,
         cache_key=f"{config_repo.get('name')}-home-{sha256(g.gh_token.encode()).hexdigest()}",
     )
     return render_template(
         "repo_home.html",
         repository=config_repo,
+        folder=folder,
         contents=contents,
+        activity=activity.folders(repo.full_name, [c["path"] for c in contents]),
+        ranking=activity.ranking(repo.full_name, _folder_path),
+        activity_days=activity.days,
+        branch=repo.default_branch,
         since=SINCE,
         max_commits=MAX_COMMITS,
     )
@@ -273,3 +288,35 @@ def section_api(repo_owner: str, repo_name: str, folder: str):
         cache_key=f"{config_repo.get('name')}-track-{sha256(g.gh_token.encode()).hexdigest()}",
     )
     return jsonify(commits)
+
+
+@app.route("/activity/<repo_owner>/<repo_name>")
+@login_management
+def repo_activity(repo_owner: str, repo_name: str):
+    """Commits per day of the sub-folders of a folder, as known from the
+    commits already fetched, and the most active ones over the last 7 days.
+
+    Args:
+        repo_owner (str): GitHub repo owner.
+        repo_name (str): GitHub repo name.
+
+    Returns:
+        str: json document
+    """
+    folder = request.args.get("folder", "").strip("/")
+    config_repo = get_repo_config(repo_owner, repo_name)
+    _folder_path = os.path.join(
+        config_repo.get("articles_folder").strip("/"), folder
+    ).strip("/")
+    _repo_name = f"{config_repo.get('owner')}/{config_repo.get('repository')}"
+    ranking = activity.ranking(_repo_name, _folder_path, limit=None)
+    return jsonify(
+        {
+            "folder": folder,
+            "days": activity.days,
+            "ranking": [{"folder": path, "week": week} for path, week in ranking],
+            "folders": activity.folders(
+                _repo_name, activity.children(_repo_name, _folder_path)
+            ),
+        }
+    )
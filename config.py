@@ -11,10 +11,29 @@ APP_DESCRIPTION = "Track changes in __repo__ documentation articles"
 # Performances limits
 SINCE = int(os.getenv("AZDOCSWATCH_SINCE", 5))
 MAX_COMMITS = int(os.getenv("AZDOCSWATCH_MAX_COMMITS", 20))
+# Admission control of the anonymous traffic (using the shared GitHub token)
+CLIENT_RATE = float(os.getenv("AZDOCSWATCH_CLIENT_RATE", 0.5))  # requests per second
+CLIENT_BURST = int(os.getenv("AZDOCSWATCH_CLIENT_BURST", 30))
+# Max concurrent GitHub API calls per worker, and max wait (in seconds) for a slot
+MAX_UPSTREAM_FETCHES = int(os.getenv("AZDOCSWATCH_MAX_UPSTREAM_FETCHES", 4))
+UPSTREAM_QUEUE_TIMEOUT = int(os.getenv("AZDOCSWATCH_UPSTREAM_QUEUE_TIMEOUT", 10))
+# Below this number of remaining shared token requests, non-configured
+# repositories are only served from the cache
+SHARED_TOKEN_RESERVE = int(os.getenv("AZDOCSWATCH_SHARED_TOKEN_RESERVE", 1000))
+RATE_LIMIT_CHECK_TTL = int(os.getenv("AZDOCSWATCH_RATE_LIMIT_CHECK_TTL", 60))
+# Number of days of per-folder activity kept in memory
+ACTIVITY_DAYS = int(os.getenv("AZDOCSWATCH_ACTIVITY_DAYS", 30))
+# Max number of folders with activity kept in memory (least recently updated are dropped)
+ACTIVITY_MAX_FOLDERS = int(os.getenv("AZDOCSWATCH_ACTIVITY_MAX_FOLDERS", 4096))
 
 # Cache configuration
 CACHE_SIZE = int(os.getenv("AZDOCSWATCH_CACHE_SIZE", 1024))
 CACHE_TTL = int(os.getenv("AZDOCSWATCH_CACHE_TTL", 600))
+# Number of repositories whose tree (of the branch head) is kept in memory for navigation
+TREE_CACHE_SIZE = int(os.getenv("AZDOCSWATCH_TREE_CACHE_SIZE", 16))
+# Cache snapshot on disk for warm restarts (disabled if no path is set)
+CACHE_SNAPSHOT_PATH = os.getenv("AZDOCSWATCH_CACHE_SNAPSHOT_PATH", "")
+CACHE_SNAPSHOT_INTERVAL = int(os.getenv("AZDOCSWATCH_CACHE_SNAPSHOT_INTERVAL", 60))
 
 # GitHub application configuration
 GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
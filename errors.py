@@ -20,6 +20,8 @@ def basic_error_handling(e):
             error_message=e.description,
         ),
         e.code,
+        # keep the specific headers of the error, like Retry-After
+        [header for header in e.get_headers() if header[0] != "Content-Type"],
     )
 
 
@@ -1,16 +1,29 @@
 import datetime
 import logging
+import math
+import posixpath
+import threading
+from collections import defaultdict
 from functools import wraps
 from markupsafe import escape
 
-from flask import g, redirect, session, url_for, abort, render_template
+from flask import g, redirect, session, url_for, abort, render_template, request
 from flask_dance.contrib.github import github as gh_auth
 from cachetools import cached
 from cachetools.keys import hashkey
 from github import Github, Repository
 from github import UnknownObjectException, RateLimitExceededException, GithubException
+from werkzeug.exceptions import TooManyRequests
 
-from utils import cache
+from utils import (
+    cache,
+    tree_cache,
+    tree_cache_lock,
+    is_tree_folder,
+    SHARED_TOKEN_HASH,
+)
+from activity import activity
+from admission import admit_client, upstream_fetch
 from errors import SAML403Exception
 from config import GITHUB_ACCESS_TOKEN, SINCE, MAX_COMMITS
 from base_routes import app
@@ -19,7 +32,30 @@ from base_routes import app
 log = logging.getLogger(__name__)
 
 
-@cached(cache)
+def repo_cache_key(prefix: str):
+    """Build a cache key function identifying the repository by its full name.
+
+    Unlike the Repository object itself, the full name is stable across
+    processes, which allows the entries to be reloaded from a cache snapshot.
+    Keys are flat tuples: (prefix, shared token used, repository full name,
+    positional arguments..., (name, value) keyword arguments...).
+
+    Args:
+        prefix (str): value prepended to the key to identify the cached function
+
+    Returns:
+        function: cache key function
+    """
+
+    def key(repo: Repository, *args, **kwargs):
+        shared = str(kwargs.get("cache_key")).endswith(f"-{SHARED_TOKEN_HASH}")
+        return hashkey(prefix, shared, repo.full_name, *args, *sorted(kwargs.items()))
+
+    return key
+
+
+@cached(cache, key=repo_cache_key("contents"), lock=cache.lock)
+@upstream_fetch
 def get_repo_contents(repo: Repository, path: str, cache_key: str) -> list:
     """Get the content of a file in a GitHub repo.
 
@@ -33,7 +69,14 @@ def get_repo_contents(repo: Repository, path: str, cache_key: str) -> list:
     """
     log.debug(f"Listing files and folders in {path}")
     try:
-        return repo.get_dir_contents(path)
+        return [
+            {
+                "name": content.name,
+                "path": content.path,
+                "type": content.type,
+            }
+            for content in repo.get_dir_contents(path)
+        ]
     except RateLimitExceededException:
         abort(429, "Rate limit exceeded")
     except Exception as e:
@@ -45,7 +88,161 @@ def get_repo_contents(repo: Repository, path: str, cache_key: str) -> list:
         abort(500, "Error while listing files and folders")
 
 
-@cached(cache, key=lambda *args, **kwargs: hashkey(kwargs["cache_key"]))
+# Git tree element types as named by the contents API
+TREE_TYPES = {"tree": "dir", "blob": "file", "commit": "submodule"}
+# Locks serializing the fetches of a tree, shared by (repository, folder) hash
+tree_fetch_locks = [threading.Lock() for _ in range(16)]
+
+
+@cached(cache, key=repo_cache_key("head"), lock=cache.lock)
+@upstream_fetch
+def get_head_tree_sha(repo: Repository, cache_key: str) -> str:
+    """Get the SHA of the root tree of the default branch head.
+
+    Args:
+        repo (Repository): GitHub repo
+        cache_key (str): key to use for the cache
+
+    Returns:
+        str: tree SHA
+    """
+    log.debug(f"Getting the head of {repo.full_name}:{repo.default_branch}")
+    try:
+        return repo.get_branch(repo.default_branch).commit.commit.tree.sha
+    except RateLimitExceededException:
+        abort(429, "Rate limit exceeded")
+    except Exception as e:
+        if isinstance(e, GithubException) and "SAML enforcement" in e.data.get(
+            "message"
+        ):
+            raise SAML403Exception({"name": repo.name, "owner": repo.owner.login})
+        log.error(e, e.__traceback__)
+        abort(500, "Error while getting the repository head")
+
+
+@upstream_fetch
+def fetch_tree_index(repo: Repository, tree_sha: str, root: str) -> dict:
+    """Index a recursive git tree by folder.
+
+    Args:
+        repo (Repository): GitHub repo
+        tree_sha (str): SHA of the root tree of the repository
+        root (str): path of the indexed sub-tree ("" for the whole repository)
+
+    Returns:
+        dict: list of contents by folder path (relative to `root`), or None if
+            the tree is too big to be returned by GitHub in one call
+    """
+    log.debug(f"Fetching the tree {tree_sha}:{root} of {repo.full_name}")
+    try:
+        tree = repo.get_git_tree(
+            f"{tree_sha}:{root}" if root else tree_sha, recursive=True
+        )
+    except RateLimitExceededException:
+        abort(429, "Rate limit exceeded")
+    except UnknownObjectException:
+        abort(404, description="Folder not found in repository")
+    except Exception as e:
+        log.error(e, e.__traceback__)
+        abort(500, "Error while listing files and folders")
+    if tree.truncated:
+        log.info(f"Tree of {repo.full_name} is truncated: using the contents API")
+        return None
+
+    index = defaultdict(list)
+    files_count = defaultdict(int)
+    for element in tree.tree:
+        folder, name = posixpath.split(element.path)
+        content_type = TREE_TYPES.get(element.type, "file")
+        index[folder].append(
+            {
+                "name": name,
+                "path": posixpath.join(root, element.path),
+                "type": content_type,
+                "relative_path": element.path,
+            }
+        )
+        if content_type == "file":
+            files_count[folder] += 1
+            while folder:
+                folder = posixpath.dirname(folder)
+                files_count[folder] += 1
+    for contents in index.values():
+        for content in contents:
+            if content["type"] == "dir":
+                content["files"] = files_count[content["relative_path"]]
+            del content["relative_path"]
+    log.debug(f"{len(tree.tree)} elements indexed in {len(index)} folders")
+    return dict(index)
+
+
+def get_tree_index(repo: Repository, tree_sha: str, root: str) -> dict:
+    """Get the index of a sub-tree of the repository.
+
+    Trees are immutable: only the index of the latest head is kept for each
+    repository, and it is refetched when the head changes.
+
+    Args:
+        repo (Repository): GitHub repo
+        tree_sha (str): SHA of the root tree of the repository
+        root (str): path of the indexed sub-tree ("" for the whole repository)
+
+    Returns:
+        dict: list of contents by folder path (relative to `root`), or None if
+            the tree is too big to be returned by GitHub in one call
+    """
+    key = (repo.full_name, root)
+    with tree_cache_lock:
+        cached_sha, index = tree_cache.get(key, (None, None))
+    if cached_sha == tree_sha:
+        return index
+    # only one request fetches a given tree, the others wait for its index
+    with tree_fetch_locks[hash(key) % len(tree_fetch_locks)]:
+        with tree_cache_lock:
+            cached_sha, index = tree_cache.get(key, (None, None))
+        if cached_sha == tree_sha:
+            return index
+        index = fetch_tree_index(repo, tree_sha, root)
+        with tree_cache_lock:
+            tree_cache[key] = (tree_sha, index)
+    return index
+
+
+def get_folder_contents(
+    repo: Repository,
+    root: str,
+    path: str,
+    cache_key: str,
+) -> list:
+    """List the files and folders of a folder in the default branch.
+
+    The listing is served from the tree index of the branch head, which is
+    only refetched when the head changes.
+
+    Args:
+        repo (Repository): GitHub repo
+        root (str): path of the articles folder
+        path (str): path to the folder, relative to `root`
+        cache_key (str): key to use for the cache
+
+    Returns:
+        list: list of contents
+    """
+    root, path = root.strip("/"), path.strip("/")
+    index = get_tree_index(repo, get_head_tree_sha(repo, cache_key=cache_key), root)
+    if index is None:
+        return get_repo_contents(
+            repo, path=posixpath.join(root, path), cache_key=cache_key
+        )
+    if path and path not in index:
+        abort(404, description="Folder not found in repository")
+    return index.get(path, [])
+
+
+@cached(
+    cache, key=lambda *args, **kwargs: hashkey(kwargs["cache_key"]), lock=cache.lock
+)
+@upstream_fetch
 def get_repo(g, config_repo: dict, cache_key: str) -> Repository:
     """Get the content of a file in a GitHub repo.
 
@@ -70,7 +267,8 @@ def get_repo(g, config_repo: dict, cache_key: str) -> Repository:
         abort(500, description="Error while listing commits")
 
 
-@cached(cache)
+@cached(cache, key=repo_cache_key("commits"), lock=cache.lock)
+@upstream_fetch
 def get_commits(
     repo: Repository,
     section_path: str,
@@ -130,6 +328,14 @@ def get_commits(
         except Exception as e:
             log.error(e, e.__traceback__)
             return abort(500, "Error while formatting commits")
+    if g.get("using_shared_gh"):
+        # activity is public: only record what anonymous users can already see
+        activity.record(
+            repo.full_name,
+            section_path,
+            ret_commits,
+            is_folder=is_tree_folder(repo.full_name, section_path),
+        )
     return ret_commits
 
 
@@ -158,6 +364,13 @@ def login_management(f):
             session["username"] = resp.json()["login"]
             g.gh_token = gh_auth.token.get("access_token")
             g.using_shared_gh = False
+        if g.using_shared_gh:
+            retry_after = admit_client(request.remote_addr)
+            if retry_after:
+                raise TooManyRequests(
+                    "Too many requests: please retry later or login with GitHub",
+                    retry_after=math.ceil(retry_after),
+                )
         g.gh = Github(g.gh_token)
         return f(*args, **kwargs)
 
@@ -1,30 +1,379 @@
 """
 """
+import atexit
 import datetime
+import gzip
+import json
 import logging
+import os
+import threading
+import time
+from hashlib import sha256
 
 from github import Repository
-from flask import request, url_for, abort
+from flask import g, request, url_for, abort
+from markupsafe import Markup
 from feedgen.feed import FeedGenerator
-from cachetools import cached, TTLCache
+from cachetools import cached, Cache, LRUCache, TLRUCache
+from cachetools.keys import hashkey
 
 from config import (
     CACHE_SIZE,
     CACHE_TTL,
+    CACHE_SNAPSHOT_PATH,
+    CACHE_SNAPSHOT_INTERVAL,
+    TREE_CACHE_SIZE,
     MAX_COMMITS,
     APP_AUTHOR,
     APP_AUTHOR_EMAIL,
     APP_DESCRIPTION,
     AZURE_DOCS_REPOS,
+    GITHUB_ACCESS_TOKEN,
 )
+from admission import shared_budget_low
+from activity import activity
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotTTLCache(TLRUCache):
+    """TTL cache that can be saved to disk and reloaded by another process.
+
+    Expiration times are based on the wall clock (instead of a monotonic
+    clock) so that reloaded entries keep their remaining TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.__expires = {}
+        self.__restored = {}
+        super().__init__(maxsize, ttu=self.__ttu, timer=time.time)
+
+    def __ttu(self, key, value, now: float) -> float:
+        expires = self.__restored.pop(key, now + self.ttl)
+        if len(self.__expires) > 2 * self.maxsize:
+            # forget expiration times of evicted entries
+            self.__expires = {k: self.__expires[k] for k in self if k in self.__expires}
+        self.__expires[key] = expires
+        return expires
+
+    def dump(self, keep) -> list:
+        """Get the live entries of the cache, without changing their recency.
+
+        Args:
+            keep (function): predicate on the keys of the entries to get
+
+        Returns:
+            list: list of (key, value, expires) tuples
+        """
+        with self.lock, self.timer as now:
+            return [
+                (key, Cache.__getitem__(self, key), expires)
+                for key, expires in list(self.__expires.items())
+                if now < expires and Cache.__contains__(self, key) and keep(key)
+            ]
+
+    def load(self, entries: list) -> int:
+        """Load entries, as returned by `dump`, in the cache.
+
+        Args:
+            entries (list): list of (key, value, expires) tuples
+
+        Returns:
+            int: number of loaded entries
+        """
+        loaded = 0
+        with self.lock:
+            now = self.timer()
+            for key, value, expires in sorted(entries, key=lambda e: e[2]):
+                if expires <= now:
+                    continue
+                self.__restored[key] = expires
+                self[key] = value
+                loaded += 1
+        return loaded
+
 
 # Configure cache
-cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
-cache_home = TTLCache(
+cache = SnapshotTTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+cache_home = SnapshotTTLCache(
     maxsize=CACHE_SIZE, ttl=CACHE_TTL * 10
 )  # 10 times longer than the other cache for the home page
+# Latest tree index of the repositories: (tree SHA, index) by (repository, folder)
+tree_cache = LRUCache(maxsize=TREE_CACHE_SIZE)
+tree_cache_lock = threading.RLock()
 
-log = logging.getLogger(__name__)
+# Caches saved in the snapshot file
+SNAPSHOT_CACHES = {"cache": cache, "cache_home": cache_home}
+# Only plain data entries are saved: cached GitHub objects embed the API token
+SNAPSHOT_KEY_PREFIXES = ("commits", "contents", "head")
+SNAPSHOT_VERSION = 2
+# Hash of the shared token, as used in the `cache_key` arguments
+SHARED_TOKEN_HASH = sha256(GITHUB_ACCESS_TOKEN.encode()).hexdigest()
+
+
+def is_snapshot_key(key: tuple) -> bool:
+    """Check if a cache entry can be saved in the snapshot file.
+
+    Only commits, contents and branch heads fetched with the shared token are
+    saved: data fetched with the token of a logged-in user (like private
+    repositories) never goes to the disk.
+
+    Args:
+        key (tuple): cache key
+
+    Returns:
+        bool: True if the entry can be saved
+    """
+    # keys are built by github_lib.repo_cache_key: (function, shared token, ...)
+    return len(key) > 1 and key[0] in SNAPSHOT_KEY_PREFIXES and key[1] is True
+
+
+def encode_snapshot_value(value):
+    """Convert a cached value to JSON data.
+
+    Cached values are lists, tuples and dicts of strings, numbers, dates and
+    escaped (Markup) strings: types which JSON does not keep are tagged.
+
+    Args:
+        value: cached value
+
+    Returns:
+        JSON serializable value
+    """
+    if isinstance(value, Markup):
+        return {"$markup": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, tuple):
+        return {"$tuple": [encode_snapshot_value(v) for v in value]}
+    if isinstance(value, list):
+        return [encode_snapshot_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: encode_snapshot_value(v) for k, v in value.items()}
+    return value
+
+
+def decode_snapshot_value(data: dict):
+    """Rebuild the tagged values of `encode_snapshot_value` (JSON object hook).
+
+    Args:
+        data (dict): JSON object
+
+    Returns:
+        decoded value
+    """
+    if len(data) == 1:
+        if "$markup" in data:
+            return Markup(data["$markup"])
+        if "$datetime" in data:
+            return datetime.datetime.fromisoformat(data["$datetime"])
+        if "$tuple" in data:
+            return tuple(data["$tuple"])
+    return data
+
+
+def read_cache_snapshot(path: str) -> dict:
+    """Read a snapshot file.
+
+    Args:
+        path (str): Snapshot file path.
+
+    Returns:
+        dict: "caches": list of (key, value, expires) tuples by cache name, and
+            "trees": list of (repository, folder, tree SHA, index) tuples; empty
+            if the file is missing or unreadable
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f, object_hook=decode_snapshot_value)
+    except Exception as e:
+        log.warning(f"Unable to read cache snapshot from {path}: {e}")
+        return {}
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        log.warning(f"Ignoring cache snapshot {path}: unsupported version")
+        return {}
+    return {
+        "caches": {
+            name: [(hashkey(*key), value, expires) for key, value, expires in entries]
+            for name, entries in snapshot.get("caches", {}).items()
+        },
+        "trees": [tuple(tree) for tree in snapshot.get("trees", [])],
+    }
+
+
+def save_cache_snapshot(path: str = CACHE_SNAPSHOT_PATH) -> int:
+    """Save the commits, contents and tree caches to a compressed file.
+
+    Tree indexes are saved when a saved branch head points to them, so only
+    the trees of repositories visible with the shared token are saved.
+    The entries are merged with the ones of the existing file, which may be
+    shared by several workers: for each key, the entry expiring last is kept.
+    The file is written next to the target and then renamed, so that a
+    concurrent reader never sees a partial snapshot. Two workers saving at
+    the same time may still lose the entries added by each other since
+    their last save.
+
+    Args:
+        path (str, optional): Snapshot file path. Defaults to CACHE_SNAPSHOT_PATH.
+
+    Returns:
+        int: number of saved entries
+    """
+    if not path:
+        return 0
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        now = time.time()
+        caches = {}
+        saved = read_cache_snapshot(path)
+        for name, c in SNAPSHOT_CACHES.items():
+            entries = {
+                key: (key, value, expires)
+                for key, value, expires in saved.get("caches", {}).get(name, [])
+                if now < expires
+            }
+            for key, value, expires in c.dump(is_snapshot_key):
+                if key not in entries or entries[key][2] < expires:
+                    entries[key] = (key, value, expires)
+            caches[name] = list(entries.values())
+        heads = {
+            (key[2], value)
+            for entries in caches.values()
+            for key, value, _ in entries
+            if key[0] == "head"
+        }
+        trees = {
+            (name, root): (name, root, sha, index)
+            for name, root, sha, index in saved.get("trees", [])
+            if (name, sha) in heads
+        }
+        with tree_cache_lock:
+            for (name, root), (sha, index) in tree_cache.items():
+                if (name, sha) in heads:
+                    trees[(name, root)] = (name, root, sha, index)
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "caches": {
+                name: [
+                    [
+                        encode_snapshot_value(list(key)),
+                        encode_snapshot_value(value),
+                        expires,
+                    ]
+                    for key, value, expires in entries
+                ]
+                for name, entries in caches.items()
+            },
+            "trees": [list(tree) for tree in trees.values()],
+        }
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        log.error(f"Unable to save cache snapshot to {path}: {e}")
+        return 0
+    count = sum(len(entries) for entries in caches.values()) + len(trees)
+    log.debug(f"{count} cache entries saved to {path}")
+    return count
+
+
+def load_cache_snapshot(path: str = CACHE_SNAPSHOT_PATH) -> int:
+    """Reload the caches from a snapshot file. Expired entries are skipped.
+
+    Reloaded commits are a cache hit for github_lib.get_commits, so they are
+    also recorded in the activity index.
+
+    Args:
+        path (str, optional): Snapshot file path. Defaults to CACHE_SNAPSHOT_PATH.
+
+    Returns:
+        int: number of loaded entries
+    """
+    snapshot = read_cache_snapshot(path)
+    count = 0
+    with tree_cache_lock:
+        for name, root, sha, index in snapshot.get("trees", []):
+            if (name, root) not in tree_cache:
+                tree_cache[(name, root)] = (sha, index)
+                count += 1
+    now = time.time()
+    for name, entries in snapshot.get("caches", {}).items():
+        if name not in SNAPSHOT_CACHES:
+            continue
+        count += SNAPSHOT_CACHES[name].load(entries)
+        for key, value, expires in entries:
+            # (prefix, shared, repository, section path, ...)
+            if key[0] == "commits" and now < expires:
+                activity.record(
+                    key[2], key[3], value, is_folder=is_tree_folder(key[2], key[3])
+                )
+    if count:
+        log.info(f"{count} cache entries loaded from {path}")
+    return count
+
+
+def start_cache_snapshots(
+    path: str = CACHE_SNAPSHOT_PATH, interval: int = CACHE_SNAPSHOT_INTERVAL
+):
+    """Reload the caches from disk, then save them every `interval` seconds
+    and when the process exits.
+
+    Args:
+        path (str, optional): Snapshot file path. Defaults to CACHE_SNAPSHOT_PATH.
+        interval (int, optional): Seconds between snapshots. Defaults to CACHE_SNAPSHOT_INTERVAL.
+    """
+    if not path:
+        log.debug("No cache snapshot path configured")
+        return
+    load_cache_snapshot(path)
+
+    def snapshot_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                save_cache_snapshot(path)
+            except Exception as e:
+                log.error(e, e.__traceback__)
+
+    threading.Thread(target=snapshot_loop, name="cache-snapshot", daemon=True).start()
+    atexit.register(save_cache_snapshot, path)
+
+
+# Configured repositories by lowercased name: GitHub names are case insensitive
+AZURE_DOCS_REPOS_BY_NAME = {
+    name.lower(): repo for name, repo in AZURE_DOCS_REPOS.items()
+}
+
+
+def is_tree_folder(repo_name: str, path: str) -> bool:
+    """Check in the tree indexes if a path is a folder of a repository.
+
+    Args:
+        repo_name (str): repository full name
+        path (str): path to check
+
+    Returns:
+        bool: True if the path is a folder of an indexed tree, False if it is a
+            file or if no tree index of the repository contains it
+    """
+    path = path.strip("/")
+    with tree_cache_lock:
+        indexes = [
+            (root, index)
+            for (name, root), (_, index) in tree_cache.items()
+            if name == repo_name and index is not None
+        ]
+    for root, index in indexes:
+        if path == root:
+            return True
+        if not root or path.startswith(f"{root}/"):
+            if path[len(root) :].strip("/") in index:
+                return True
+    return False
 
 
 def get_repo_config(repo_owner: str = None, repo_name: str = None) -> dict:
@@ -44,7 +393,7 @@ def get_repo_config(repo_owner: str = None, repo_name: str = None) -> dict:
         abort(400, "Missing repository owner or name")
     repo_keyname = "/".join([repo_owner, repo_name])
     log.debug(f"Looking for repository {repo_keyname} in configuration")
-    config_repo = AZURE_DOCS_REPOS.get(repo_keyname)
+    config_repo = AZURE_DOCS_REPOS_BY_NAME.get(repo_keyname.lower())
     if not config_repo:
         log.debug(
             "Repository not found in configuration: format custom repository like a configured one"
@@ -57,6 +406,11 @@ def get_repo_config(repo_owner: str = None, repo_name: str = None) -> dict:
             "articles_folder": "/",
             "icon": "",
         }
+        if g.get("using_shared_gh") and shared_budget_low():
+            log.warning(
+                f"Shared GitHub token budget is low: serving {repo_keyname} from cache only"
+            )
+            g.cached_only = True
     return config_repo
 
 